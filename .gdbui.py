@@ -6,9 +6,18 @@
 ####################################################
 
 import gdb
+import functools
 import re
+import struct
 import sys
 import os
+import time
+
+# ============================================================================
+# Regular Expressions
+# ============================================================================
+
+_RE_STR = re.compile(r'"[^"]*"')
 
 # ============================================================================
 # Color Definitions
@@ -49,24 +58,42 @@ def get_terminal_size():
     try:
         size = os.get_terminal_size()
         return size.columns, size.lines
-    except:
-        # Fallback method
+    except OSError:
+        # Not a tty, use the environment or a default
         try:
-            import subprocess
-            output = subprocess.check_output(['stty', 'size'], stderr=subprocess.DEVNULL)
-            rows, cols = output.decode().strip().split()
-            return int(cols), int(rows)
-        except:
-            return 120, 40  # Default fallback
+            return int(os.environ.get("COLUMNS", "120")), int(os.environ.get("LINES", "40"))
+        except ValueError:
+            return 120, 40
 
 def colorize(text, color):
     """Apply color to text"""
     return f"{color}{text}{Colors.RESET}"
 
-def print_separator(char='─', label='', color=Colors.CYAN, width=None):
-    """Print a separator line with optional label"""
+def colorize_run(parts):
+    """Colorize a sequence of (text, color) parts, color may be None for plain text"""
+    # Only emit an escape when the color actually changes, and reset once at
+    # the end, instead of wrapping every part in its own color + reset pair
+    out = []
+    current = None
+
+    for text, color in parts:
+        if not text:
+            continue
+        # Whitespace looks the same in any foreground color
+        if color != current and not text.isspace():
+            out.append(color if color else Colors.RESET)
+            current = color
+        out.append(text)
+
+    if current:
+        out.append(Colors.RESET)
+
+    return ''.join(out)
+
+def format_separator(char='─', label='', color=Colors.CYAN, width=None):
+    """Build a separator line with optional label"""
     if width is None:
-        width, _ = get_terminal_size()
+        width = _LAYOUT.width
 
     if label:
         label_text = f" {label} "
@@ -76,20 +103,72 @@ def print_separator(char='─', label='', color=Colors.CYAN, width=None):
         line = char * left + label_text + char * right
     else:
         line = char * width
-    print(colorize(line, color))
+    return colorize(line, color)
+
+# Address formats, 64-bit or 32-bit depending on the value
+_ADDR_TEXT = "0x%016x"
+_ADDR_TEXT_32 = "0x%08x"
+_ADDR_FMT = f"{Colors.ADDRESS}{_ADDR_TEXT}{Colors.RESET}"
+_ADDR_FMT_32 = f"{Colors.ADDRESS}{_ADDR_TEXT_32}{Colors.RESET}"
+_ADDR_NULL = colorize("0x0", Colors.GRAY)
+
+def address_run(addr):
+    """Get the (text, color) part for an address"""
+    if addr is None or addr == 0:
+        return "0x0", Colors.GRAY
+
+    if addr > 0xFFFFFFFF:
+        return _ADDR_TEXT % addr, Colors.ADDRESS
+    return _ADDR_TEXT_32 % addr, Colors.ADDRESS
 
 def format_address(addr):
     """Format address with color"""
     if addr is None or addr == 0:
-        return colorize("0x0", Colors.GRAY)
+        return _ADDR_NULL
 
-    # Determine if it's a 32-bit or 64-bit address
-    if addr > 0xFFFFFFFF:
-        addr_str = f"0x{addr:016x}"
-    else:
-        addr_str = f"0x{addr:08x}"
+    return _ADDR_FMT % addr if addr > 0xFFFFFFFF else _ADDR_FMT_32 % addr
+
+# ============================================================================
+# Cached Lookups
+# ============================================================================
+
+@functools.lru_cache(maxsize=4096)
+def _info_symbol(addr):
+    """Get the `info symbol` description of an address, or "" if none"""
+    try:
+        sym_info = gdb.execute(f"info symbol 0x{addr:x}", to_string=True).strip()
+    except:
+        return ""
 
-    return colorize(addr_str, Colors.ADDRESS)
+    if not sym_info or 'No symbol' in sym_info:
+        return ""
+
+    return sym_info.split('\n')[0]
+
+@functools.lru_cache(maxsize=4096)
+def _deref_long(addr):
+    """Read the 8-byte value stored at addr, or None if unreadable"""
+    try:
+        mem = gdb.selected_inferior().read_memory(addr, 8)
+        return int.from_bytes(bytes(mem), 'little')
+    except:
+        return None
+
+@functools.lru_cache(maxsize=64)
+def _read_source(filename, mtime):
+    """Read the lines of a source file, mtime is only part of the cache key"""
+    with open(filename, 'r') as f:
+        # Not splitlines(), which also breaks on form feeds and other
+        # separators and would shift every following line number
+        return f.readlines()
+
+def _clear_symbol_cache(event=None):
+    """Symbols only move when objfiles are loaded or unloaded"""
+    _info_symbol.cache_clear()
+
+def _clear_memory_cache(event=None):
+    """Memory may change whenever the inferior runs or is written to"""
+    _deref_long.cache_clear()
 
 # ============================================================================
 # Layout Manager
@@ -144,14 +223,31 @@ class LayoutManager:
         self.padding_lines = max(0, self.height - used_lines - 1)
 
     def refresh(self):
-        """Refresh terminal size"""
-        self.width, self.height = get_terminal_size()
-        self.calculate_sections()
+        """Refresh terminal size, recalculating sections only if it changed"""
+        size = get_terminal_size()
+        if size != (self.width, self.height):
+            self.width, self.height = size
+            self.calculate_sections()
+
+_LAYOUT = LayoutManager()
 
 # ============================================================================
 # Register Display
 # ============================================================================
 
+# (mask, name) of the eflags bits we display
+_EFLAG_BITS = (
+    (1 << 0, 'carry'),
+    (1 << 2, 'PARITY'),
+    (1 << 4, 'adjust'),
+    (1 << 6, 'ZERO'),
+    (1 << 7, 'sign'),
+    (1 << 8, 'trap'),
+    (1 << 9, 'INTERRUPT'),
+    (1 << 10, 'direction'),
+    (1 << 11, 'overflow'),
+)
+
 class RegisterDisplay:
     """Display CPU registers in a formatted manner"""
 
@@ -161,41 +257,59 @@ class RegisterDisplay:
 
     def __init__(self):
         self.prev_values = {}
+        self._cache = None
+        self._frame = None
 
-    def get_register_value(self, reg_name):
-        """Get the value of a register"""
+    def _read_all_registers(self):
+        """Read all general registers with a single `info registers` command"""
+        self._cache = {}
         try:
-            val = gdb.parse_and_eval(f"${reg_name}")
-            return int(val)
+            info = gdb.execute("info registers general", to_string=True)
         except:
-            return None
+            return
+
+        # Each line looks like "rax            0x1c                28"
+        for line in info.splitlines():
+            fields = line.split(None, 2)
+            if len(fields) < 2:
+                continue
+            try:
+                self._cache[fields[0]] = int(fields[1], 16)
+            except ValueError:
+                pass
+
+    def get_register_value(self, reg_name):
+        """Get the value of a register"""
+        if self._cache is None:
+            self._read_all_registers()
+
+        if reg_name not in self._cache:
+            # Not part of the general group on this target, read it directly
+            try:
+                self._cache[reg_name] = int(self._frame.read_register(reg_name))
+            except:
+                self._cache[reg_name] = None
+
+        return self._cache[reg_name]
 
     def get_pointer_info(self, addr):
-        """Try to get information about what an address points to"""
+        """Try to get information about what an address points to, as a (text, color) part"""
         if addr == 0:
-            return ""
+            return None
 
-        try:
-            # Try to read as pointer
-            val = gdb.parse_and_eval(f"*(long*)0x{addr:x}")
-            val_int = int(val)
-            return format_address(val_int)
-        except:
-            pass
+        # Try to read as pointer
+        val_int = _deref_long(addr)
+        if val_int is not None:
+            return address_run(val_int)
 
-        try:
-            # Try to get symbol
-            sym_info = gdb.execute(f"info symbol 0x{addr:x}", to_string=True).strip()
-            if 'No symbol' not in sym_info and sym_info:
-                # Clean up symbol info
-                sym_info = sym_info.split('\n')[0]
-                if len(sym_info) > 40:
-                    sym_info = sym_info[:37] + "..."
-                return colorize(sym_info, Colors.COMMENT)
-        except:
-            pass
+        # Try to get symbol
+        sym_info = _info_symbol(addr)
+        if sym_info:
+            if len(sym_info) > 40:
+                sym_info = sym_info[:37] + "..."
+            return sym_info, Colors.COMMENT
 
-        return ""
+        return None
 
     def format_register_line(self, reg_name, value):
         """Format a single register line"""
@@ -204,76 +318,62 @@ class RegisterDisplay:
 
         # Format register name
         if changed:
-            reg_label = colorize(f"${reg_name:<4s}", Colors.REGISTER_CHANGED)
+            reg_label = (f"${reg_name:<4s}", Colors.REGISTER_CHANGED)
         else:
-            reg_label = colorize(f"${reg_name:<4s}", Colors.REGISTER_NAME)
+            reg_label = (f"${reg_name:<4s}", Colors.REGISTER_NAME)
 
         # Format value
         if value is None:
-            val_str = colorize("0x0", Colors.GRAY)
+            val_str = ("0x0", Colors.GRAY)
         else:
             if changed:
-                val_str = colorize(f"0x{value:016x}" if value > 0xFFFFFFFF else f"0x{value:08x}",
-                                 Colors.REGISTER_CHANGED)
+                val_str = (_ADDR_TEXT % value if value > 0xFFFFFFFF else _ADDR_TEXT_32 % value,
+                           Colors.REGISTER_CHANGED)
             else:
-                val_str = format_address(value)
+                val_str = address_run(value)
 
         # Build the line
-        result = f"{reg_label} : {val_str}"
+        parts = [reg_label, (" : ", None), val_str]
 
         # Add annotation for special registers
-        annotation = ""
+        annotation = None
         if value and value != 0:
             if reg_name in ['rsp', 'rbp', 'rsi', 'rdi']:
                 annotation = self.get_pointer_info(value)
             elif reg_name == 'rip':
                 try:
                     # Try to get function name
-                    frame = gdb.selected_frame()
-                    func = frame.function()
+                    func = self._frame.function()
                     if func:
-                        annotation = colorize(f"<{func.name}>", Colors.COMMENT)
+                        annotation = (f"<{func.name}>", Colors.COMMENT)
                 except:
                     pass
 
         if annotation:
-            arrow = colorize(" → ", Colors.ARROW)
-            result += f"{arrow}{annotation}"
+            parts.append((" → ", Colors.ARROW))
+            parts.append(annotation)
 
         # Update previous values
         self.prev_values[reg_name] = value
 
-        return result
+        return colorize_run(parts)
 
     def parse_eflags(self, eflags):
         """Parse eflags register into readable format"""
-        flags = []
-        flag_bits = [
-            (0, 'carry'),
-            (2, 'PARITY'),
-            (4, 'adjust'),
-            (6, 'ZERO'),
-            (7, 'sign'),
-            (8, 'trap'),
-            (9, 'INTERRUPT'),
-            (10, 'direction'),
-            (11, 'overflow'),
-        ]
-
-        for bit, name in flag_bits:
-            if eflags & (1 << bit):
-                flags.append(name)
-
-        return ' '.join(flags) if flags else 'none'
+        return ' '.join(name for mask, name in _EFLAG_BITS if eflags & mask) or 'none'
 
-    def display(self):
+    def display(self, buf, frame):
         """Display all registers"""
-        print_separator(label="registers", color=Colors.CYAN)
+        # Register values are only valid for the current stop and frame
+        self._cache = None
+        self._frame = frame
+
+        buf.append(format_separator(label="registers", color=Colors.CYAN))
 
         # Display general purpose registers
         for reg in self.GENERAL_REGS:
             val = self.get_register_value(reg)
-            print(self.format_register_line(reg, val))
+            buf.append(self.format_register_line(reg, val))
 
         # Display flags register
         eflags = self.get_register_value('eflags')
@@ -283,7 +383,7 @@ class RegisterDisplay:
             val_str = format_address(eflags)
             arrow = colorize(" → ", Colors.ARROW)
             comment = colorize(f"[{flags_str}]", Colors.COMMENT)
-            print(f"{reg_label:10s} : {val_str}{arrow}{comment}")
+            buf.append(f"{reg_label:10s} : {val_str}{arrow}{comment}")
 
         # Display segment registers
         seg_parts = []
@@ -295,7 +395,7 @@ class RegisterDisplay:
                 seg_parts.append(f"{seg_label}: {val_str}")
 
         if seg_parts:
-            print("  ".join(seg_parts))
+            buf.append("  ".join(seg_parts))
 
 # ============================================================================
 # Stack Display
@@ -304,112 +404,156 @@ class RegisterDisplay:
 class StackDisplay:
     """Display stack contents"""
 
-    def display(self, lines=10):
+    def display(self, buf, frame, lines=10):
         """Display stack contents"""
-        print_separator(label="stack", color=Colors.CYAN)
+        buf.append(format_separator(label="stack", color=Colors.CYAN))
 
         try:
             # Get stack pointer
-            sp = int(gdb.parse_and_eval("$rsp"))
+            sp = int(frame.read_register("rsp"))
 
-            # Read stack values
-            for i in range(lines):
-                addr = sp + (i * 8)
-                try:
-                    val = gdb.parse_and_eval(f"*(long*)0x{addr:x}")
-                    val_int = int(val)
+            # Read the whole window at once, falling back to one slot at a
+            # time if part of it is unreadable
+            try:
+                mem = gdb.selected_inferior().read_memory(sp, lines * 8)
+                values = struct.unpack(f"<{lines}Q", bytes(mem))
+            except:
+                values = [_deref_long(sp + (i * 8)) for i in range(lines)]
 
-                    # Format components
-                    addr_str = format_address(addr)
-                    offset_str = colorize(f"+0x{i*8:04x}", Colors.GRAY)
-                    val_str = format_address(val_int)
+            for i, val_int in enumerate(values):
+                if val_int is None:
+                    continue
 
+                addr = sp + (i * 8)
+                try:
                     # Build line
-                    line = f"{addr_str} {offset_str}: {val_str}"
+                    parts = [address_run(addr), (" ", None),
+                             (f"+0x{i*8:04x}", Colors.GRAY), (": ", None),
+                             address_run(val_int)]
 
                     # Add annotations
-                    annotation = ""
                     if i == 0:
-                        annotation = colorize("← $rsp", Colors.COMMENT)
+                        parts.append(("← $rsp", Colors.COMMENT))
                     else:
                         # Try to resolve symbol
-                        try:
-                            sym_info = gdb.execute(f"info symbol 0x{val_int:x}", to_string=True).strip()
-                            if 'No symbol' not in sym_info and sym_info:
-                                sym_info = sym_info.split('\n')[0]
-                                if len(sym_info) > 50:
-                                    sym_info = sym_info[:47] + "..."
-                                arrow = colorize(" → ", Colors.ARROW)
-                                annotation = f"{arrow}{colorize(sym_info, Colors.COMMENT)}"
-                        except:
-                            pass
-
-                    if annotation:
-                        line += annotation
-
-                    print(line)
+                        sym_info = _info_symbol(val_int)
+                        if sym_info:
+                            if len(sym_info) > 50:
+                                sym_info = sym_info[:47] + "..."
+                            parts.append((" → ", Colors.ARROW))
+                            parts.append((sym_info, Colors.COMMENT))
+
+                    buf.append(colorize_run(parts))
                 except:
                     pass
         except:
-            print(colorize("  Stack not available", Colors.GRAY))
+            buf.append(colorize("  Stack not available", Colors.GRAY))
 
 # ============================================================================
 # Code Display
 # ============================================================================
 
+# Register names highlighted in instruction operands
+_REG_SET = frozenset(
+    [f"r{r}" for r in ('ax', 'bx', 'cx', 'dx', 'sp', 'bp', 'si', 'di')] +
+    [f"e{r}" for r in ('ax', 'bx', 'cx', 'dx', 'sp', 'bp', 'si', 'di')] +
+    [f"r{n}{s}" for n in range(8, 16) for s in ('', 'd', 'w', 'b')]
+)
+
+# Maps every operand separator to NUL, so that splitting the translated
+# operands on NUL yields the words and their positions in the original
+_OPERAND_SEPARATORS = str.maketrans({c: '\0' for c in ' \t,()[]{}%$*+-:!#<>'})
+
 class CodeDisplay:
     """Display disassembly and source code"""
 
-    def display(self, disasm_lines=8):
+    # Number of functions whose disassembly is kept
+    DISASM_CACHE_SIZE = 64
+
+    def __init__(self):
+        # Parsed disassembly per function, keyed by (func_start, func_end),
+        # in least to most recently used order
+        self._disasm_cache = {}
+        gdb.events.new_objfile.connect(self.clear_cache)
+        gdb.events.clear_objfiles.connect(self.clear_cache)
+        # Code patched from the debugger must show up
+        gdb.events.memory_changed.connect(self.clear_cache)
+
+    def clear_cache(self, event=None):
+        """Drop cached disassembly"""
+        self._disasm_cache.clear()
+
+    def function_block(self, frame):
+        """Get the block of the function containing the frame, or None"""
+        try:
+            block = frame.block()
+        except:
+            return None
+
+        # Walk up to the function's outermost block, whose parent is the
+        # static block, so calls inlined into it are not taken for the
+        # function itself
+        while block.superblock is not None and not block.superblock.is_static:
+            block = block.superblock
+
+        return block if block.function else None
+
+    def disassemble(self, arch, start, end, pc, func):
+        """Disassemble [start, end), returns (lines, pc -> line index map)"""
+        try:
+            insns = arch.disassemble(start, end - 1)
+        except:
+            insns = []
+
+        # Decoding from an arbitrary address before pc may not land on pc,
+        # just disassemble forward
+        if not any(insn['addr'] == pc for insn in insns):
+            insns = arch.disassemble(pc, pc + (end - start) - 1)
+
+        all_lines = []
+        pc_to_idx = {}
+        for insn in insns:
+            pc_to_idx[insn['addr']] = len(all_lines)
+            all_lines.append(self.format_disasm_line(insn['addr'], insn['asm'], func))
+
+        return all_lines, pc_to_idx
+
+    def display(self, buf, frame, disasm_lines=8):
         """Display code around current instruction"""
-        print_separator(label="code:i386:x86-64", color=Colors.CYAN)
+        buf.append(format_separator(label="code:i386:x86-64", color=Colors.CYAN))
 
         lines_printed = 0
 
         try:
             # Get current program counter
-            pc = int(gdb.parse_and_eval("$rip"))
-
-            # First, try to disassemble the entire function to get all lines
-            try:
-                # Try to get the function bounds
-                frame = gdb.selected_frame()
-                block = frame.block()
-                if block:
-                    # Get function start and end
-                    while block.function is None and block.superblock is not None:
-                        block = block.superblock
-
-                    if block.function:
-                        func_start = block.start
-                        func_end = block.end
-                        disasm = gdb.execute(f"disassemble 0x{func_start:x},0x{func_end:x}", to_string=True)
-                    else:
-                        raise Exception("No function block")
-                else:
-                    raise Exception("No block")
-            except:
-                # Fallback: disassemble around PC
+            pc = int(frame.read_register("rip"))
+
+            arch = frame.architecture()
+            block = self.function_block(frame)
+
+            if block is not None:
+                # Decoding from the function start always lands on instruction
+                # boundaries, and within a function the disassembly never
+                # changes between stops, only the current instruction does
+                key = (block.start, block.end)
+                cached = self._disasm_cache.pop(key, None)
+                if cached is None or pc not in cached[1]:
+                    func = (block.function.print_name, block.start)
+                    cached = self.disassemble(arch, block.start, block.end, pc, func)
+
+                # Reinsert as most recently used, evicting the oldest entry
+                self._disasm_cache[key] = cached
+                if len(self._disasm_cache) > self.DISASM_CACHE_SIZE:
+                    del self._disasm_cache[next(iter(self._disasm_cache))]
+            else:
+                # No function bounds, disassemble a window around pc
                 # Use larger range to ensure we get enough context
                 before = disasm_lines * 8  # More bytes before
                 after = disasm_lines * 8   # More bytes after
-                try:
-                    disasm = gdb.execute(f"disassemble $rip-{before},$rip+{after}", to_string=True)
-                except:
-                    # If that fails, just disassemble forward
-                    disasm = gdb.execute(f"disassemble $rip,$rip+{after*2}", to_string=True)
-
-            # Parse all disassembly lines
-            all_lines = []
-            current_idx = -1
+                cached = self.disassemble(arch, pc - before, pc + after, pc, None)
 
-            for line in disasm.split('\n'):
-                if line.strip() and not line.startswith('Dump') and not line.startswith('End of'):
-                    formatted = self.format_disasm_line(line, pc)
-                    if formatted:
-                        if '=>' in line:
-                            current_idx = len(all_lines)
-                        all_lines.append(formatted)
+            all_lines, pc_to_idx = cached
+            current_idx = pc_to_idx.get(pc, -1)
 
             # Display exactly disasm_lines (8) lines centered around current instruction
             if current_idx >= 0:
@@ -421,121 +565,119 @@ class CodeDisplay:
                 # Adjust start if we're near the end
                 if end - start < disasm_lines:
                     start = max(0, end - disasm_lines)
-
-                for line in all_lines[start:end]:
-                    print(line)
-                    lines_printed += 1
             else:
-                # No current instruction marker found, show first N lines
-                for line in all_lines[:disasm_lines]:
-                    print(line)
-                    lines_printed += 1
+                # Current instruction not found, show first N lines
+                start = 0
+                end = min(len(all_lines), disasm_lines)
+
+            current_marker = colorize('→', Colors.CURRENT_LINE)
+            for idx in range(start, end):
+                marker = current_marker if idx == current_idx else ' '
+                buf.append(f"{marker} {all_lines[idx]}")
+                lines_printed += 1
 
         except Exception as e:
-            print(colorize(f"  Code not available", Colors.GRAY))
+            buf.append(colorize(f"  Code not available", Colors.GRAY))
             lines_printed += 1
 
         # Pad with empty lines to reach exactly disasm_lines
         while lines_printed < disasm_lines:
-            print()
+            buf.append("")
             lines_printed += 1
 
         # Try to show source code (returns number of lines printed)
-        lines_printed += self.display_source()
-
-    def format_disasm_line(self, line, current_pc):
-        """Format a disassembly line with colors"""
-        if not line.strip():
-            return None
-
-        is_current = '=>' in line
+        lines_printed += self.display_source(buf, frame)
 
-        # Remove => marker
-        line = line.replace('=>', '  ')
+    def format_disasm_line(self, addr, asm, func=None):
+        """Format a disassembled instruction with colors"""
+        # The current instruction marker is added by display() so that
+        # formatted lines can be cached and reused across stops
+        parts = [address_run(addr)]
 
-        # Parse the line (format: "   0x401234 <func+20>:  mov    rax, rdi")
-        parts = line.split(':', 1)
-        if len(parts) != 2:
-            return line
-
-        addr_part = parts[0].strip()
-        instr_part = parts[1].strip()
-
-        # Extract address
-        addr_match = re.search(r'0x[0-9a-f]+', addr_part)
-        if not addr_match:
-            return line
-
-        addr = addr_match.group(0)
-
-        # Extract function info if present
-        func_match = re.search(r'<([^>]+)>', addr_part)
-        func_info = ""
-        if func_match:
-            func_info = colorize(f" <{func_match.group(1)}>", Colors.COMMENT)
+        # Function info, func is (name, start) of the enclosing function
+        if func is not None and addr >= func[1]:
+            parts.append((f" <{func[0]}+{addr - func[1]}>", Colors.COMMENT))
+        else:
+            # No debug info (libc, PLT, stripped binaries), use the minimal
+            # symbol, "puts + 4 in section .text of libc.so.6" -> "puts+4"
+            sym_info = _info_symbol(addr)
+            if sym_info:
+                label = sym_info.split(" in section ")[0].replace(" + ", "+")
+                if "+" not in label:
+                    label += "+0"
+                parts.append((f" <{label}>", Colors.COMMENT))
 
-        # Format address
-        addr_colored = format_address(int(addr, 16))
+        parts.append((":  ", None))
 
         # Format instruction
-        instr_formatted = self.colorize_instruction(instr_part)
+        parts.extend(self.instruction_parts(asm.strip()))
 
-        # Build the line
-        if is_current:
-            marker = colorize('→', Colors.CURRENT_LINE)
-            result = f"{marker} {addr_colored}{func_info}:  {instr_formatted}"
-        else:
-            marker = ' '
-            result = f"{marker} {addr_colored}{func_info}:  {instr_formatted}"
+        return colorize_run(parts)
 
-        return result
-
-    def colorize_instruction(self, instr):
-        """Colorize instruction mnemonics and operands"""
+    def instruction_parts(self, instr):
+        """Split an instruction into (text, color) parts"""
         # Split instruction and operands
         parts = instr.split(None, 1)
         if not parts:
-            return instr
-
-        mnemonic = parts[0]
-        operands = parts[1] if len(parts) > 1 else ""
+            return [(instr, None)]
 
         # Color mnemonic
-        mnemonic_colored = colorize(mnemonic, Colors.YELLOW)
-
-        # Color operands
-        if operands:
-            # Color addresses
-            operands = re.sub(r'(0x[0-9a-f]+)',
-                            lambda m: colorize(m.group(1), Colors.ADDRESS),
-                            operands)
-            # Color registers
-            operands = re.sub(r'\b(r[abcd]x|r[sb]p|r[sd]i|r[0-9]+[dwb]?|e[abcd]x|e[sb]p|e[sd]i)\b',
-                            lambda m: colorize(m.group(1), Colors.REGISTER_NAME),
-                            operands)
-            # Color strings
-            operands = re.sub(r'"[^"]*"',
-                            lambda m: colorize(m.group(0), Colors.STRING),
-                            operands)
-
-        return f"{mnemonic_colored}    {operands}" if operands else mnemonic_colored
-
-    def display_source(self):
+        result = [(parts[0], Colors.YELLOW)]
+
+        # Color addresses, registers and strings in the operands
+        if len(parts) > 1:
+            operands = parts[1]
+            result.append(("    ", None))
+
+            # Quoted strings are rare, only look for them if there is a quote
+            if '"' in operands:
+                pos = 0
+                for match in _RE_STR.finditer(operands):
+                    self.operand_parts(operands[pos:match.start()], result)
+                    result.append((match.group(0), Colors.STRING))
+                    pos = match.end()
+                self.operand_parts(operands[pos:], result)
+            else:
+                self.operand_parts(operands, result)
+
+        return result
+
+    def operand_parts(self, operands, result):
+        """Append (text, color) parts for the words and separators of operands"""
+        pos = 0
+        end = len(operands)
+
+        for word in operands.translate(_OPERAND_SEPARATORS).split('\0'):
+            if word:
+                if word in _REG_SET:
+                    result.append((word, Colors.REGISTER_NAME))
+                elif word.startswith('0x'):
+                    result.append((word, Colors.ADDRESS))
+                else:
+                    result.append((word, None))
+                pos += len(word)
+
+            # The separator that ended this word
+            if pos < end:
+                result.append((operands[pos], None))
+                pos += 1
+
+    def display_source(self, buf, frame):
         """Display source code if available, returns number of lines printed"""
         lines_printed = 0
         try:
-            sal = gdb.selected_frame().find_sal()
+            sal = frame.find_sal()
             if sal.symtab and sal.line > 0:
                 filename = sal.symtab.filename
                 line_num = sal.line
 
                 # Get just the basename for display
                 basename = os.path.basename(filename)
-                print_separator(label=f"source:{basename}+{line_num}", color=Colors.CYAN)
+                buf.append(format_separator(label=f"source:{basename}+{line_num}", color=Colors.CYAN))
                 lines_printed += 1
 
-                with open(filename, 'r') as f:
-                    lines = f.readlines()
+                # Keyed on mtime so edited files are read again
+                lines = _read_source(filename, os.path.getmtime(filename))
 
                 # Display context (5 lines: 2 before, current, 2 after)
                 start = max(0, line_num - 3)
@@ -554,7 +696,7 @@ class CodeDisplay:
                         marker = ' '
                         num_str = colorize(num_str, Colors.GRAY)
 
-                    print(f"{marker} {num_str}  {line_text}")
+                    buf.append(f"{marker} {num_str}  {line_text}")
                     lines_printed += 1
         except:
             pass
@@ -568,24 +710,35 @@ class CodeDisplay:
 class ThreadDisplay:
     """Display thread information"""
 
-    def display(self):
+    def display(self, buf):
         """Display active threads (compact)"""
-        print_separator(label="threads", color=Colors.CYAN)
+        buf.append(format_separator(label="threads", color=Colors.CYAN))
 
         try:
-            info = gdb.execute("info threads", to_string=True)
-            lines = [l for l in info.split('\n') if l.strip()]
-
-            # Show only first 2 threads or all if less
-            for line in lines[:3]:
-                if line.strip():
-                    # Highlight current thread
-                    if '*' in line[:5]:
-                        print(colorize(line, Colors.CURRENT_LINE))
-                    else:
-                        print(line)
+            selected = gdb.selected_thread()
+            threads = sorted(gdb.selected_inferior().threads(), key=lambda t: t.num)
+
+            if not threads:
+                buf.append(colorize("  No threads", Colors.GRAY))
+
+            # Show only first 3 threads or all if less
+            for idx, thread in enumerate(threads[:3]):
+                if thread.is_exited():
+                    state = "exited"
+                elif thread.is_running():
+                    state = "running"
+                else:
+                    state = "stopped"
+
+                line = f"[#{idx}] Id {thread.num}, Name: \"{thread.name or ''}\", {state}"
+
+                # Highlight current thread
+                if selected is not None and thread.ptid == selected.ptid:
+                    buf.append(colorize(line, Colors.CURRENT_LINE))
+                else:
+                    buf.append(line)
         except:
-            print(colorize("  [#0] Id 1, Name: \"program\", stopped", Colors.WHITE))
+            buf.append(colorize("  [#0] Id 1, Name: \"program\", stopped", Colors.WHITE))
 
 # ============================================================================
 # Backtrace Display
@@ -594,32 +747,78 @@ class ThreadDisplay:
 class BacktraceDisplay:
     """Display call stack backtrace"""
 
-    def display(self, limit=2):
+    def frame_args(self, frame):
+        """Format the arguments of a frame as "name=value, ...", empty without debug info"""
+        try:
+            block = frame.block()
+        except:
+            return ""
+
+        # Arguments live in the function's outermost block
+        while block.function is None and block.superblock is not None:
+            block = block.superblock
+
+        # Follow "print frame-arguments" like backtrace does (all, scalars,
+        # none or presence)
+        try:
+            mode = gdb.parameter("print frame-arguments")
+        except:
+            mode = "scalars"
+
+        args = []
+        for sym in block:
+            if not sym.is_argument:
+                continue
+
+            if mode == "none" or (mode == "scalars" and not self.is_scalar(sym.type)):
+                value = "..."
+            else:
+                try:
+                    # Always keep the trace on one line per frame
+                    value = sym.value(frame).format_string(pretty_structs=False,
+                                                           pretty_arrays=False)
+                except:
+                    value = "<error reading variable>"
+            args.append(f"{sym.print_name}={value}")
+
+        if mode == "presence":
+            return "..." if args else ""
+        return ", ".join(args)
+
+    def is_scalar(self, type_):
+        """Check whether "print frame-arguments scalars" prints a value of this type"""
+        type_ = type_.strip_typedefs()
+        if type_.code in (gdb.TYPE_CODE_REF, gdb.TYPE_CODE_RVALUE_REF):
+            type_ = type_.target().strip_typedefs()
+        return type_.code not in (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION, gdb.TYPE_CODE_ARRAY)
+
+    def display(self, buf, limit=2):
         """Display backtrace (compact)"""
-        print_separator(label="trace", color=Colors.CYAN)
+        buf.append(format_separator(label="trace", color=Colors.CYAN))
 
         try:
-            bt = gdb.execute(f"backtrace {limit}", to_string=True)
-            lines = [l for l in bt.split('\n') if l.strip()]
-
-            for line in lines[:limit+1]:
-                if line.strip():
-                    # Color frame numbers
-                    line = re.sub(r'(#\d+)', lambda m: colorize(m.group(1), Colors.CYAN), line)
-                    # Color addresses
-                    line = re.sub(r'(0x[0-9a-f]+)', lambda m: colorize(m.group(1), Colors.ADDRESS), line)
-                    # Color function names
-                    line = re.sub(r'\bin\s+(\w+)', lambda m: f"in {colorize(m.group(1), Colors.YELLOW)}", line)
-                    print(line)
+            frame = gdb.newest_frame()
+
+            for level in range(limit):
+                if frame is None:
+                    break
+
+                parts = [(f"#{level}", Colors.CYAN), ("  ", None),
+                         address_run(frame.pc()), (" in ", None),
+                         (frame.name() or "??", Colors.YELLOW),
+                         (f" ({self.frame_args(frame)})", None)]
+
+                sal = frame.find_sal()
+                if sal.symtab:
+                    parts.append((f" at {sal.symtab.filename}:{sal.line}", None))
+
+                buf.append(colorize_run(parts))
+                frame = frame.older()
+
+            if frame is not None:
+                buf.append("(More stack frames follow...)")
         except:
-            try:
-                frame = gdb.selected_frame()
-                if frame.function():
-                    func_name = frame.function().name
-                    pc = frame.pc()
-                    print(f"{colorize('#0', Colors.CYAN)} {format_address(pc)} → {colorize(f'{func_name}()', Colors.YELLOW)}")
-            except:
-                print(colorize("  Backtrace not available", Colors.GRAY))
+            buf.append(colorize("  Backtrace not available", Colors.GRAY))
 
 # ============================================================================
 # Main Context Display
@@ -629,7 +828,7 @@ class ContextDisplay:
     """Main context display combining all components"""
 
     def __init__(self):
-        self.layout = LayoutManager()
+        self.layout = _LAYOUT
         self.reg_display = RegisterDisplay()
         self.stack_display = StackDisplay()
         self.code_display = CodeDisplay()
@@ -641,11 +840,20 @@ class ContextDisplay:
         # Refresh layout to get current terminal size
         self.layout.refresh()
 
+        # Collect the whole frame and write it out at once
+        buf = []
+
+        # Every section reads from the same frame
+        try:
+            frame = gdb.selected_frame()
+        except gdb.error:
+            frame = None
+
         # Track total lines printed
         lines_printed = 0
 
         # Don't clear screen, just start fresh
-        print()
+        buf.append("")
         lines_printed += 1
 
         # Display legend at the top
@@ -655,37 +863,43 @@ class ContextDisplay:
         legend += colorize("Heap", Colors.GREEN) + " | "
         legend += colorize("Stack", Colors.MAGENTA) + " | "
         legend += colorize("String", Colors.STRING) + " ]"
-        print(legend)
+        buf.append(legend)
         lines_printed += 1
 
         # Display all sections
-        self.reg_display.display()
+        self.reg_display.display(buf, frame)
         lines_printed += 1 + self.layout.registers_content_lines  # separator + content
 
-        self.stack_display.display(lines=self.layout.stack_lines)
+        self.stack_display.display(buf, frame, lines=self.layout.stack_lines)
         lines_printed += 1 + self.layout.stack_lines  # separator + content
 
-        self.code_display.display(disasm_lines=self.layout.code_disasm_lines)
+        self.code_display.display(buf, frame, disasm_lines=self.layout.code_disasm_lines)
         lines_printed += self.layout.code_separators + self.layout.code_disasm_lines + self.layout.code_source_lines
 
-        self.thread_display.display()
+        self.thread_display.display(buf)
         lines_printed += 1 + self.layout.threads_lines  # separator + content
 
-        self.trace_display.display()
+        self.trace_display.display(buf)
         lines_printed += 1 + self.layout.trace_lines  # separator + content
 
         # Print bottom separator
-        width, _ = get_terminal_size()
-        print(colorize("─" * width, Colors.CYAN))
+        buf.append(colorize("─" * self.layout.width, Colors.CYAN))
         lines_printed += 1
 
         # Fill remaining lines with empty lines to reach bottom of screen
         # Leave 1 line for the command prompt
         for _ in range(self.layout.padding_lines):
-            print()
+            buf.append("")
 
+        # Go through GDB's stream so MI, TUI, logging and to_string capture
+        # all see the output
+        sys.stdout.write("\n".join(buf) + "\n")
         sys.stdout.flush()
 
+# Shared by the context command and the stop handler, so that register change
+# highlighting and the display caches are the same for both
+_CONTEXT = ContextDisplay()
+
 # ============================================================================
 # GDB Commands
 # ============================================================================
@@ -695,22 +909,79 @@ class ContextCommand(gdb.Command):
 
     def __init__(self):
         super(ContextCommand, self).__init__("context", gdb.COMMAND_USER)
-        self.display = ContextDisplay()
 
     def invoke(self, arg, from_tty):
-        self.display.display()
+        _CONTEXT.display()
 
 # Hook into stop events
 class ContextStopHandler:
     """Automatically display context when execution stops"""
 
+    # Minimum time between two automatic displays (seconds)
+    THROTTLE = 0.05
+
     def __init__(self):
-        self.display = ContextDisplay()
+        self._last_state = None
+        self._next_allowed = 0.0
+        self._pending = False  # A stop was skipped by the throttle
         gdb.events.stop.connect(self.handle_stop)
+        gdb.events.cont.connect(self.handle_cont)
+        gdb.events.before_prompt.connect(self.handle_before_prompt)
+        gdb.events.exited.connect(self.reset)
+        gdb.events.clear_objfiles.connect(self.reset)
+
+    def reset(self, event=None):
+        """Forget the last displayed stop, e.g. when the program is restarted"""
+        self._last_state = None
+
+    def stop_state(self):
+        """Get the thread and registers that tell two stops apart"""
+        frame = gdb.selected_frame()
+        # rcx and rdi change while pc stays put on rep-prefixed instructions
+        return (gdb.selected_thread().ptid,
+                int(frame.read_register("rip")),
+                int(frame.read_register("rsp")),
+                int(frame.read_register("rcx")),
+                int(frame.read_register("rdi")))
+
+    def render(self, state):
+        """Display the context and start a new throttle interval"""
+        _CONTEXT.display()
+        self._last_state = state
+        self._next_allowed = time.monotonic() + self.THROTTLE
 
     def handle_stop(self, event):
         try:
-            self.display.display()
+            state = self.stop_state()
+
+            # Nothing new to show if we stopped again in the same state,
+            # unless a breakpoint, watchpoint or signal was hit
+            if (state == self._last_state
+                    and not isinstance(event, (gdb.BreakpointEvent, gdb.SignalEvent))):
+                return
+
+            # During bursts of stops (stepi loops, scripts) only display the
+            # last one, right before GDB shows its prompt again
+            if time.monotonic() < self._next_allowed:
+                self._pending = True
+                return
+
+            self.render(state)
+        except Exception as e:
+            print(colorize(f"Error displaying context: {e}", Colors.RED))
+
+    def handle_cont(self, event):
+        # A skipped stop is stale once execution resumes, the next stop will
+        # either display or be skipped in turn
+        self._pending = False
+
+    def handle_before_prompt(self):
+        if not self._pending:
+            return
+
+        self._pending = False
+        try:
+            self.render(self.stop_state())
         except Exception as e:
             print(colorize(f"Error displaying context: {e}", Colors.RED))
 
@@ -720,14 +991,23 @@ class ContextStopHandler:
 
 def init_enhanced_ui():
     """Initialize the enhanced UI"""
-    print()
-    print(colorize("╔════════════════════════════════════════╗", Colors.CYAN))
-    print(colorize("║         GDB Enhanced UI Loaded         ║", Colors.CYAN))
-    print(colorize("╚════════════════════════════════════════╝", Colors.CYAN))
-    print(colorize("\nCommands:", Colors.YELLOW))
-    print(colorize("  context  - Display context manually", Colors.WHITE))
-    print(colorize("\nAuto-display is enabled on all stops\n", Colors.GREEN))
-    print()
+    if os.environ.get("GDBUI_VERBOSE"):
+        print()
+        print(colorize("╔════════════════════════════════════════╗", Colors.CYAN))
+        print(colorize("║         GDB Enhanced UI Loaded         ║", Colors.CYAN))
+        print(colorize("╚════════════════════════════════════════╝", Colors.CYAN))
+        print(colorize("\nCommands:", Colors.YELLOW))
+        print(colorize("  context  - Display context manually", Colors.WHITE))
+        print(colorize("\nAuto-display is enabled on all stops\n", Colors.GREEN))
+        print()
+    else:
+        print(colorize("GDB Enhanced UI loaded, auto-display on stops ('context' to display manually)", Colors.CYAN))
+
+    # Drop cached lookups when they may have gone stale
+    gdb.events.new_objfile.connect(_clear_symbol_cache)
+    gdb.events.clear_objfiles.connect(_clear_symbol_cache)
+    gdb.events.cont.connect(_clear_memory_cache)
+    gdb.events.memory_changed.connect(_clear_memory_cache)
 
     # Register commands
     ContextCommand()